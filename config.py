@@ -20,4 +20,9 @@ if MULTI_TOKEN_ENABLED:
     MAX_CONCURRENT_STREAMS = 6
 else:
     MAX_CONCURRENT_STREAMS = 1
-    
+
+# Har stream ke liye kitne 1MB GetFile requests ek saath flight mein rahein (kam se kam 1, warna body khali)
+PREFETCH_CHUNKS = max(1, int(os.environ.get("PREFETCH_CHUNKS", 4)))
+
+# Hot GetFile blocks (moov, seek points) ke liye RAM cache, MB mein; 0 = band
+BLOCK_CACHE_MB = int(os.environ.get("BLOCK_CACHE_MB", 64))
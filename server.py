@@ -1,13 +1,26 @@
+import re
 import time
+import logging
 import hmac
-import hashlib
+import base64
 import asyncio
+from collections import OrderedDict, deque
+from contextlib import aclosing, contextmanager
+from functools import lru_cache, partial
 from urllib.parse import quote
 
+import anyio
 from fastapi import FastAPI, Request, HTTPException, Response
-from fastapi.responses import StreamingResponse, HTMLResponse
+from fastapi.responses import HTMLResponse
 from pyrogram import Client, filters
 from pyrogram.types import Message
+from pyrogram.errors import RPCError
+from pyrogram.file_id import FileId
+from pyrogram.raw.functions.auth import ExportAuthorization, ImportAuthorization
+from pyrogram.raw.functions.upload import GetFile
+from pyrogram.raw.types import InputDocumentFileLocation
+from pyrogram.session import Session
+from pyrogram.session.auth import Auth
 import uvicorn
 import config
 
@@ -22,9 +35,11 @@ client = Client(
     workers=16
 )
 
+logger = logging.getLogger(__name__)
+
 app = FastAPI()
 active_streams_count = 0
-lock = asyncio.Lock()
+_clock_task = None
 
 # --- Helper Functions ---
 def human_size(bytes, units=['B', 'KB', 'MB', 'GB', 'TB']):
@@ -34,16 +49,57 @@ def human_size(bytes, units=['B', 'KB', 'MB', 'GB', 'TB']):
         bytes /= 1024
     return f"{bytes:.2f} {units[-1]}"
 
+# Token expiry seconds mein hai; clock background task se update hota hai, har request par time.time() nahi
+_now = int(time.time())
+
+async def _tick():
+    global _now
+    while True:
+        _now = int(time.time())
+        await asyncio.sleep(0.5)
+
+# Key schedule ek hi baar; har token ke liye sirf copy() + update()
+_KEY = config.SECRET_KEY.encode()
+_HMAC_TMPL = hmac.new(_KEY, b"", "sha256")
+
+# Token = raw 32-byte digest ka base64url (bina "=" padding), hex se 21 chars chhota
+_TOKEN_LEN = 43
+
+def _sign(payload: bytes) -> bytes:
+    h = _HMAC_TMPL.copy()
+    h.update(payload)
+    return h.digest()
+
+def _payload(file_id: str, expiry: int) -> bytes:
+    return file_id.encode() + expiry.to_bytes(8, "big")
+
+# VLC/browser ek hi URL se dozens Range requests bhejte hain: expected token cache se, HMAC dobara nahi
+@lru_cache(maxsize=4096)
+def _token_for(file_id: str, expiry: int) -> str:
+    return base64.urlsafe_b64encode(_sign(_payload(file_id, expiry))).rstrip(b"=").decode("ascii")
+
+# Expiry ko 1 minute ke bucket par round karte hain, taaki same file ka link cache se mile
+_LINK_BUCKET = 60
+# Pyrogram file_id pehle se URL-safe base64 hai; quote() sirf ajeeb id par
+_URL_SAFE_RE = re.compile(r"[A-Za-z0-9_-]+")
+
+@lru_cache(maxsize=4096)
+def _signed(file_id: str, file_size: int, bucket: int, endpoint: str) -> str:
+    expiry = (bucket + 1) * _LINK_BUCKET + config.TOKEN_EXPIRY
+    token = _token_for(file_id, expiry)
+    if not _URL_SAFE_RE.fullmatch(file_id): file_id = quote(file_id)
+    return f"{config.BASE_URL}/{endpoint}?file_id={file_id}&size={file_size}&token={token}&exp={expiry}"
+
 def generate_secure_link(file_id: str, file_size: int, endpoint: str) -> str:
-    expiry = int(time.time()) + config.TOKEN_EXPIRY
-    payload = f"{file_id}{expiry}".encode()
-    token = hmac.new(config.SECRET_KEY.encode(), payload, hashlib.sha256).hexdigest()
-    return f"{config.BASE_URL}/{endpoint}?file_id={quote(file_id)}&size={file_size}&token={token}&exp={expiry}"
+    return _signed(file_id, file_size, _now // _LINK_BUCKET, endpoint)
 
 def verify_token(file_id: str, token: str, expiry: int) -> bool:
-    if time.time() > expiry: return False
-    payload = f"{file_id}{expiry}".encode()
-    expected = hmac.new(config.SECRET_KEY.encode(), payload, hashlib.sha256).hexdigest()
+    if _now > expiry: return False
+    if len(token) != _TOKEN_LEN or not token.isascii(): return False
+    try:
+        expected = _token_for(file_id, expiry)
+    except OverflowError:
+        return False
     return hmac.compare_digest(expected, token)
 
 # --- Bot Handlers ---
@@ -65,88 +121,189 @@ async def video_handler(c: Client, m: Message):
 # --- Server Logic ---
 @app.on_event("startup")
 async def startup_event():
+    global _clock_task
+    _clock_task = asyncio.create_task(_tick())
     print("Starting Client...")
     await client.start()
 
 @app.on_event("shutdown")
 async def shutdown_event():
     print("Stopping Client...")
+    for session in _dc_sessions.values():
+        await session.stop()
+    _dc_sessions.clear()
+    _dc_locks.clear()
     await client.stop()
+    _clock_task.cancel()
+
+@contextmanager
+def stream_slot():
+    global active_streams_count
+    # Check aur increment ke beech koi await nahi, isliye lock ki zarurat nahi
+    if active_streams_count >= config.MAX_CONCURRENT_STREAMS:
+        raise HTTPException(503, "Server busy")
+    active_streams_count += 1
+    try:
+        yield
+    finally:
+        active_streams_count -= 1
+
+# --- Telegram File Location Cache ---
+# Ek video ke liye player dozens Range requests bhejta hai, FileId har baar decode mat karo
+@lru_cache(maxsize=1024)
+def _location_for(file_id_str: str):
+    d = FileId.decode(file_id_str)
+    location = InputDocumentFileLocation(
+        id=d.media_id,
+        access_hash=d.access_hash,
+        file_reference=d.file_reference,
+        thumb_size=""
+    )
+    return d.dc_id, location
+
+# --- Media DC Sessions ---
+# Har DC (home DC bhi) ka alag is_media session, taaki downloads bot ke updates/replies wale
+# main connection ko jam na karein. Ek baar ban gaya to na lock, na storage query
+_dc_sessions = {}
+# Lock har DC ka alag: ek DC down ho (Session.start retry karta rahe) to baaki DC ke streams na atkein
+_dc_locks = {}
+
+async def _start_media_session(client: Client, dc_id: int) -> Session:
+    test_mode = await client.storage.test_mode()
+    home = dc_id == await client.storage.dc_id()
+    # Home DC par bot ki apni auth key (pyrogram get_file jaisa), baaki DC par nayi key + auth import
+    auth_key = await client.storage.auth_key() if home else await Auth(client, dc_id, test_mode).create()
+    session = Session(client, dc_id, auth_key, test_mode, is_media=True)
+    await session.start()
+    try:
+        if not home:
+            exported = await client.invoke(ExportAuthorization(dc_id=dc_id))
+            await session.invoke(ImportAuthorization(id=exported.id, bytes=exported.bytes))
+    except BaseException:
+        await session.stop()
+        raise
+    return session
+
+async def _media_session(client: Client, dc_id: int) -> Session:
+    session = _dc_sessions.get(dc_id)
+    if session is None:
+        async with _dc_locks.setdefault(dc_id, asyncio.Lock()):
+            session = _dc_sessions.get(dc_id)
+            if session is None:
+                session = _dc_sessions[dc_id] = await _start_media_session(client, dc_id)
+    return session
+
+# --- Hot Block Cache ---
+# Players moov/header aur seek points baar baar maangte hain; aise GetFile blocks RAM mein LRU.
+# Block doosri baar maanga jaaye tabhi cache mein jaata hai, taaki ek linear playback/download
+# poora cache flush karke moov blocks na nikaal de
+_BLOCK = 1024 * 1024
+
+class BlockCache:
+    def __init__(self, max_bytes: int, max_seen: int = 8192):
+        self.max_bytes = max_bytes
+        self.max_seen = max_seen
+        self.size = 0
+        self.blocks = OrderedDict()
+        self.seen = OrderedDict()
+
+    def _lookup(self, key):
+        data = self.blocks.get(key)
+        if data is not None:
+            self.blocks.move_to_end(key)
+        return data
+
+    def get(self, media_id: int, offset: int, limit: int):
+        data = self._lookup((media_id, offset, limit))
+        if data is None and limit < _BLOCK:
+            # Chhota probe cached 1MB block ke andar ho to wahin se slice (file ke end par block chhota ho sakta hai)
+            base = offset - offset % _BLOCK
+            block = self._lookup((media_id, base, _BLOCK))
+            if block is not None:
+                data = memoryview(block)[offset - base:offset - base + limit]
+        return data
+
+    def put(self, key, data: bytes):
+        if len(data) > self.max_bytes or key in self.blocks: return
+        # Pehli baar sirf key yaad rakho, data nahi
+        if key not in self.seen:
+            self.seen[key] = None
+            if len(self.seen) > self.max_seen: self.seen.popitem(last=False)
+            return
+        del self.seen[key]
+        self.blocks[key] = data
+        self.size += len(data)
+        while self.size > self.max_bytes:
+            _, old = self.blocks.popitem(last=False)
+            self.size -= len(old)
+
+block_cache = BlockCache(config.BLOCK_CACHE_MB * 1024 * 1024)
+
+# --- THE PIPELINED GetFile GENERATOR ---
+# Itne seconds tak ka FloodWait chunk task khud sleep karke retry karta hai (pyrogram get_file jaisa)
+FLOOD_WAIT_THRESHOLD = 30
+
+async def _fetch_block(session, location, offset: int, limit: int) -> bytes:
+    data = block_cache.get(location.id, offset, limit)
+    if data is None:
+        r = await session.invoke(
+            GetFile(location=location, offset=offset, limit=limit),
+            sleep_threshold=FLOOD_WAIT_THRESHOLD
+        )
+        data = r.bytes
+        block_cache.put((location.id, offset, limit), data)
+    return data
 
-class StreamManager:
-    async def __aenter__(self):
-        global active_streams_count
-        async with lock:
-            if active_streams_count >= config.MAX_CONCURRENT_STREAMS:
-                raise HTTPException(503, "Server busy")
-            active_streams_count += 1
-        return self
-    async def __aexit__(self, *args):
-        global active_streams_count
-        async with lock:
-            active_streams_count -= 1
-
-# --- THE "LOOPING STREAM" GENERATOR (Ultimate Fix) ---
 async def file_generator(client: Client, file_id_str: str, start: int, end: int):
-    # 1. Alignment Logic (Telegram 4KB Rule)
-    # Start point ko 4096 se align karo
-    offset = start - (start % 4096)
+    # 1. Alignment Logic (Telegram 1MB Rule)
+    # GetFile ka offset limit ka multiple hona chahiye, request 1MB boundary cross nahi kar sakti.
+    # Chhoti range (moov scan, ffmpeg probe) ke liye limit bhi chhota (4KB..1MB power of 2),
+    # taaki 128KB ke liye poora 1MB download na ho
+    bytes_left = end - start + 1
+    chunk_limit = min(1024 * 1024, max(4096, 1 << (bytes_left - 1).bit_length()))
+    offset = start - (start % chunk_limit)
+    last_offset = end - (end % chunk_limit)
     first_chunk_skip = start - offset
-    
-    # Chunk Size: 1MB (Safe & Stable)
-    chunk_limit = 1024 * 1024 
-
-    while offset <= end:
-        try:
-            # 2. Use stream_media BUT with a limit!
-            # Ye 'offset' aur 'limit' leta hai aur khud DC4/DC5 par switch karta hai.
-            async for chunk in client.stream_media(file_id_str, offset=offset, limit=chunk_limit):
-                
-                # 3. Trimming Logic (First Chunk Only)
-                if first_chunk_skip > 0:
-                    if len(chunk) > first_chunk_skip:
-                        chunk = chunk[first_chunk_skip:]
-                        first_chunk_skip = 0
-                    else:
-                        first_chunk_skip -= len(chunk)
-                        offset += len(chunk)
-                        continue
-
-                # 4. End Check
-                # Agar user ko end tak nahi chahiye (pause/seek), to extra mat bhejo
-                bytes_needed = end - (offset - (len(chunk) if first_chunk_skip == 0 else 0)) + 1
-                # (Simple logic: just send, browser handles excess)
-                
-                yield chunk
-                
-                # 5. Offset Update & Break
-                # Jaise hi ek chunk mila, offset update karo
-                offset += len(chunk)
-                
-                # Pyrogram stream automatically continues, but we want to break 
-                # after 1MB to refresh connection and prevent timeouts.
-                # However, stream_media with limit automatically stops.
-                
-            # Loop wapas chalega agle 1MB ke liye
-            
-        except Exception as e:
-            # FloodWait ya Timeout handle karne ke liye
-            print(f"⚠️ Stream Error: {e}. Retrying same segment...")
-            await asyncio.sleep(2)
-            continue
+    pending = deque()
+
+    try:
+        # 2. File ke DC ka media session (DC4/DC5 fix), ek baar bana ke reuse
+        dc_id, location = _location_for(file_id_str)
+        session = await _media_session(client, dc_id)
+
+        while bytes_left > 0:
+            # 3. Pipeline: agle chunks pehle se maang lo, taaki Telegram RTT client write ke saath overlap ho
+            while offset <= last_offset and len(pending) < config.PREFETCH_CHUNKS:
+                pending.append(asyncio.ensure_future(_fetch_block(session, location, offset, chunk_limit)))
+                offset += chunk_limit
+            if not pending: break
+
+            chunk = await pending.popleft()
+
+            # 4. Trimming Logic (first aur last chunk), memoryview se taaki 1MB copy na ho
+            if first_chunk_skip or len(chunk) > bytes_left:
+                chunk = memoryview(chunk)[first_chunk_skip:first_chunk_skip + bytes_left]
+                first_chunk_skip = 0
+
+            # 5. File khatam
+            if not chunk: break
+
+            yield chunk
+            bytes_left -= len(chunk)
+
+    except (OSError, asyncio.TimeoutError, RPCError) as e:
+        # CancelledError (client disconnect) yahan nahi pakadte, use upar jaane do
+        logger.warning("Stream Error: %s", e)
+    finally:
+        # Client chala gaya ya error aaya: bache hue GetFile cancel karo
+        for task in pending: task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
 
 # --- UI HTML Player ---
-@app.get("/watch", response_class=HTMLResponse)
-async def watch_video(request: Request, file_id: str, size: int, token: str, exp: int):
-    if not verify_token(file_id, token, exp): return "<h1>Invalid/Expired Link</h1>"
-    stream_url = generate_secure_link(file_id, size, endpoint="stream")
-    download_url = generate_secure_link(file_id, size, endpoint="download")
-    
-    profile_img_url = "https://i.ibb.co/kY1Nyzs/1765464889401-2.jpg"
-    random_middle_img = "https://picsum.photos/150/100?grayscale"
-    playit_icon_url = "https://cdn-icons-png.flaticon.com/512/0/375.png"
+# Page ek hi baar bytes mein compile hota hai; har request par sirf links ka ek bytes % substitution
+_HTML_ESCAPE = str.maketrans({"&": "&amp;", '"': "&quot;", "<": "&lt;", ">": "&gt;"})
 
-    html_content = f"""
+_WATCH_PAGE = """
     <!DOCTYPE html>
     <html lang="en">
     <head>
@@ -154,46 +311,46 @@ async def watch_video(request: Request, file_id: str, size: int, token: str, exp
         <meta name="viewport" content="width=device-width, initial-scale=1.0">
         <title>Raj_hd_movies Player</title>
         <style>
-            body {{ background-color: #000; color: #fff; font-family: sans-serif; display: flex; flex-direction: column; align-items: center; margin: 0; padding: 20px 10px; text-align: center; min-height: 100vh; box-sizing: border-box; }}
-            .header-title {{ font-size: 3.5em; font-family: "Brush Script MT", cursive, sans-serif; margin-bottom: 5px; line-height: 1.2; }}
-            .sub-title {{ color: #888; font-size: 1em; margin-bottom: 25px; }}
-            .profile-img {{ width: 90px; height: 90px; border-radius: 50%; object-fit: cover; margin-bottom: 25px; border: 2px solid #222; }}
-            video {{ width: 100%; max-width: 800px; aspect-ratio: 16 / 9; border-radius: 8px; margin-bottom: 25px; background: #111; box-shadow: 0 4px 15px rgba(255,255,255,0.1); }}
-            .channel-name {{ font-size: 2.8em; font-weight: bold; margin-bottom: 35px; letter-spacing: 1px; }}
-            .players-row {{ display: flex; justify-content: space-between; align-items: center; width: 100%; max-width: 600px; margin: 0 auto 40px auto; padding: 0 10px; box-sizing: border-box; }}
-            .player-link {{ text-decoration: none; color: white; font-size: 2.2em; font-weight: bold; display: flex; align-items: center; }}
-            .playit-icon-img {{ width: 35px; height: 35px; margin-right: 10px; filter: brightness(0) saturate(100%) invert(63%) sepia(68%) saturate(450%) hue-rotate(346deg) brightness(101%) contrast(101%); }}
-            .middle-img-container {{ flex-grow: 1; display: flex; justify-content: center; padding: 0 15px; }}
-            .middle-img {{ width: 100%; max-width: 140px; height: auto; border-radius: 6px; object-fit: cover; opacity: 0.8; }}
-            .download-btn {{ background: linear-gradient(to bottom, #53e03d, #3ab028); border: 2px solid #2ecc71; border-radius: 12px; padding: 12px 25px; display: flex; align-items: center; justify-content: space-between; text-decoration: none; color: white; width: 90%; max-width: 380px; margin-bottom: 50px; box-shadow: 0 6px 15px rgba(76, 209, 55, 0.4); transition: transform 0.1s; }}
-            .download-btn:active {{ transform: scale(0.98); }}
-            .dl-arrow-left {{ font-size: 2.5em; margin-right: 15px; font-weight: bold; color: #dfffce; text-shadow: 0 2px 2px rgba(0,0,0,0.2); }}
-            .dl-text-container {{ text-align: left; flex-grow: 1; }}
-            .dl-small {{ font-size: 1em; display: block; opacity: 0.9; }}
-            .dl-big {{ font-size: 1.6em; font-weight: 900; display: block; text-transform: uppercase; }}
-            .dl-icon-right {{ font-size: 1.8em; margin-left: 15px; }}
-            .footer-text {{ font-weight: bold; margin-bottom: 15px; font-size: 1.2em; }}
-            @media (max-width: 400px) {{ .header-title {{ font-size: 2.8em; }} .channel-name {{ font-size: 2.2em; }} .player-link {{ font-size: 1.8em; }} .middle-img {{ max-width: 100px; }} }}
+            body { background-color: #000; color: #fff; font-family: sans-serif; display: flex; flex-direction: column; align-items: center; margin: 0; padding: 20px 10px; text-align: center; min-height: 100vh; box-sizing: border-box; }
+            .header-title { font-size: 3.5em; font-family: "Brush Script MT", cursive, sans-serif; margin-bottom: 5px; line-height: 1.2; }
+            .sub-title { color: #888; font-size: 1em; margin-bottom: 25px; }
+            .profile-img { width: 90px; height: 90px; border-radius: 50%%; object-fit: cover; margin-bottom: 25px; border: 2px solid #222; }
+            video { width: 100%%; max-width: 800px; aspect-ratio: 16 / 9; border-radius: 8px; margin-bottom: 25px; background: #111; box-shadow: 0 4px 15px rgba(255,255,255,0.1); }
+            .channel-name { font-size: 2.8em; font-weight: bold; margin-bottom: 35px; letter-spacing: 1px; }
+            .players-row { display: flex; justify-content: space-between; align-items: center; width: 100%%; max-width: 600px; margin: 0 auto 40px auto; padding: 0 10px; box-sizing: border-box; }
+            .player-link { text-decoration: none; color: white; font-size: 2.2em; font-weight: bold; display: flex; align-items: center; }
+            .playit-icon-img { width: 35px; height: 35px; margin-right: 10px; filter: brightness(0) saturate(100%%) invert(63%%) sepia(68%%) saturate(450%%) hue-rotate(346deg) brightness(101%%) contrast(101%%); }
+            .middle-img-container { flex-grow: 1; display: flex; justify-content: center; padding: 0 15px; }
+            .middle-img { width: 100%%; max-width: 140px; height: auto; border-radius: 6px; object-fit: cover; opacity: 0.8; }
+            .download-btn { background: linear-gradient(to bottom, #53e03d, #3ab028); border: 2px solid #2ecc71; border-radius: 12px; padding: 12px 25px; display: flex; align-items: center; justify-content: space-between; text-decoration: none; color: white; width: 90%%; max-width: 380px; margin-bottom: 50px; box-shadow: 0 6px 15px rgba(76, 209, 55, 0.4); transition: transform 0.1s; }
+            .download-btn:active { transform: scale(0.98); }
+            .dl-arrow-left { font-size: 2.5em; margin-right: 15px; font-weight: bold; color: #dfffce; text-shadow: 0 2px 2px rgba(0,0,0,0.2); }
+            .dl-text-container { text-align: left; flex-grow: 1; }
+            .dl-small { font-size: 1em; display: block; opacity: 0.9; }
+            .dl-big { font-size: 1.6em; font-weight: 900; display: block; text-transform: uppercase; }
+            .dl-icon-right { font-size: 1.8em; margin-left: 15px; }
+            .footer-text { font-weight: bold; margin-bottom: 15px; font-size: 1.2em; }
+            @media (max-width: 400px) { .header-title { font-size: 2.8em; } .channel-name { font-size: 2.2em; } .player-link { font-size: 1.8em; } .middle-img { max-width: 100px; } }
         </style>
     </head>
     <body>
         <div class="header-title">Raj_hd_movies</div>
         <div class="sub-title">powered by Rajdev</div>
-        <img src="{profile_img_url}" alt="Profile" class="profile-img">
+        <img src="https://i.ibb.co/kY1Nyzs/1765464889401-2.jpg" alt="Profile" class="profile-img">
         <video controls autoplay playsinline>
-            <source src="{stream_url}" type="video/mp4">
+            <source src="%(stream_url)b" type="video/mp4">
             Your browser does not support the video tag.
         </video>
         <div class="channel-name">AstraToonix</div>
         <div class="players-row">
-            <a href="intent:{stream_url}#Intent;package=com.playit.videoplayer;type=video/*;scheme=https;end" class="player-link">
-                <img src="{playit_icon_url}" alt="play" class="playit-icon-img">
+            <a href="intent:%(stream_url)b#Intent;package=com.playit.videoplayer;type=video/*;scheme=https;end" class="player-link">
+                <img src="https://cdn-icons-png.flaticon.com/512/0/375.png" alt="play" class="playit-icon-img">
                 <span>playit</span>
             </a>
-            <div class="middle-img-container"><img src="{random_middle_img}" alt="Random" class="middle-img"></div>
-            <a href="intent:{stream_url}#Intent;package=org.videolan.vlc;type=video/*;scheme=https;end" class="player-link"><span>vlc</span></a>
+            <div class="middle-img-container"><img src="https://picsum.photos/150/100?grayscale" alt="Random" class="middle-img"></div>
+            <a href="intent:%(stream_url)b#Intent;package=org.videolan.vlc;type=video/*;scheme=https;end" class="player-link"><span>vlc</span></a>
         </div>
-        <a href="{download_url}" class="download-btn">
+        <a href="%(download_url)b" class="download-btn">
             <div class="dl-arrow-left">≫</div>
             <div class="dl-text-container"><span class="dl-small">Click here to</span><span class="dl-big">DOWNLOAD</span></div>
             <div class="dl-icon-right">📥</div>
@@ -202,40 +359,112 @@ async def watch_video(request: Request, file_id: str, size: int, token: str, exp
         <div class="footer-text">ram ram</div>
     </body>
     </html>
-    """
-    return HTMLResponse(content=html_content)
+    """.encode()
+
+# Bura/expired link: ek hi frozen response, har baar naya object aur encode nahi
+_INVALID_LINK = HTMLResponse(content=b"<h1>Invalid/Expired Link</h1>", status_code=403)
+
+@app.get("/watch", response_class=HTMLResponse)
+async def watch_video(request: Request, file_id: str, size: int, token: str, exp: int):
+    if not verify_token(file_id, token, exp): return _INVALID_LINK
+    stream_url = generate_secure_link(file_id, size, endpoint="stream")
+    download_url = generate_secure_link(file_id, size, endpoint="download")
+    return HTMLResponse(content=_WATCH_PAGE % {
+        b"stream_url": stream_url.translate(_HTML_ESCAPE).encode(),
+        b"download_url": download_url.translate(_HTML_ESCAPE).encode(),
+    })
+
+# --- Raw ASGI Stream Response ---
+class RangeStreamResponse(Response):
+    # StreamingResponse + gen() wrapper ki jagah: chunks seedha ASGI send() par jaate hain.
+    # Slot headers bhejne se pehle liya jata hai, taaki busy server sach mein 503 de (khali 206 nahi).
+    def __init__(self, file_id: str, start: int, end: int, status_code: int, raw_headers: tuple):
+        self.file_id = file_id
+        self.start = start
+        self.end = end
+        self.status_code = status_code
+        self.background = None
+        self.raw_headers = raw_headers
+
+    async def stream_body(self, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        sent = 0
+        async with aclosing(file_generator(client, self.file_id, self.start, self.end)) as chunks:
+            async for chunk in chunks:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                sent += len(chunk)
+        # Telegram beech mein ruk gaya (error ya galat size): final frame mat bhejo, response adhoora
+        # chhodo. Uvicorn connection band karta hai aur player Range se resume kar leta hai
+        expected = self.end - self.start + 1
+        if sent < expected:
+            logger.warning("Stream cut short: %d of %d bytes sent", sent, expected)
+            return
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def listen_for_disconnect(self, receive):
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    async def __call__(self, scope, receive, send):
+        with stream_slot():
+            # Client disconnect hote hi body cancel, taaki Telegram fetch aur slot turant chhoot jaayein
+            async with anyio.create_task_group() as tg:
+                async def wrap(func):
+                    await func()
+                    tg.cancel_scope.cancel()
+                tg.start_soon(wrap, partial(self.stream_body, send))
+                await wrap(partial(self.listen_for_disconnect, receive))
+
+# Har number max 19 digits (int64 tak); isse lambe header par int() ki 4300-digit limit nahi lagti
+_RANGE_RE = re.compile(r"bytes=(\d{0,19})-(\d{0,19})(?!\d)")
+
+def _parse_range(range_header: str, file_size: int):
+    # "bytes=START-END", "bytes=START-" ya suffix "bytes=-N" (aakhri N bytes).
+    # Galat/ulta header ignore hota hai (None), tab poori file jaati hai
+    m = _RANGE_RE.match(range_header)
+    if not m: return None
+    s, e = m.group(1), m.group(2)
+    if s:
+        start = int(s)
+        end = int(e) if e else file_size - 1
+        if e and end < start: return None
+    elif e:
+        start = file_size - min(int(e), file_size)
+        end = file_size - 1
+    else:
+        return None
+    return start, end
+
+# Same file ke same range (0- ya seek points) ke headers baar baar bante the; ab cache se.
+# Seedha ASGI raw (bytes, bytes) pairs, taaki Starlette ko har request par encode na karna pade
+_BASE_HEADERS = (
+    (b"accept-ranges", b"bytes"),
+    (b"content-type", b"video/mp4"),
+    (b"connection", b"keep-alive"),
+)
+
+@lru_cache(maxsize=16384)
+def _headers_for(file_size: int, start: int, end: int, disposition: str, ranged: bool) -> tuple:
+    headers = _BASE_HEADERS + (
+        (b"content-length", b"%d" % (end - start + 1)),
+        (b"content-disposition", disposition.encode()),
+    )
+    if ranged:
+        headers += ((b"content-range", b"bytes %d-%d/%d" % (start, end, file_size)),)
+    return headers
 
 async def stream_logic(request: Request, file_id: str, size: int, disposition: str):
     file_size = size
     range_header = request.headers.get("range")
-    start, end = 0, file_size - 1
-    if range_header:
-        try:
-            unit, r = range_header.split("=")
-            if unit == "bytes":
-                parts = r.split("-")
-                start = int(parts[0]) if parts[0] else 0
-                end = int(parts[1]) if len(parts) > 1 and parts[1] else file_size - 1
-        except: pass
+    byte_range = _parse_range(range_header, file_size) if range_header else None
+    start, end = byte_range or (0, file_size - 1)
 
     if start >= file_size: return Response(status_code=416, headers={"Content-Range": f"bytes */{file_size}"})
     end = min(end, file_size - 1)
-    content_length = end - start + 1
-    headers = {
-        "Content-Range": f"bytes {start}-{end}/{file_size}",
-        "Accept-Ranges": "bytes",
-        "Content-Length": str(content_length),
-        "Content-Type": "video/mp4",
-        "Content-Disposition": disposition,
-        "Connection": "keep-alive"
-    }
-    async def gen():
-        try:
-            async with StreamManager():
-                async for chunk in file_generator(client, file_id, start, end):
-                    yield chunk
-        except: pass
-    return StreamingResponse(gen(), status_code=206, headers=headers)
+    # Range nahi maanga (normal download) to poori file 200 ke saath, Content-Range ki zaroorat nahi
+    status_code = 206 if byte_range else 200
+    raw_headers = _headers_for(file_size, start, end, disposition, status_code == 206)
+    return RangeStreamResponse(file_id, start, end, status_code=status_code, raw_headers=raw_headers)
 
 @app.get("/stream")
 async def stream_route(request: Request, file_id: str, size: int, token: str, exp: int):
@@ -248,5 +477,9 @@ async def download_route(request: Request, file_id: str, size: int, token: str,
     return await stream_logic(request, file_id, size, "attachment")
 
 if __name__ == "__main__":
-    uvicorn.run(app, host=config.BIND_ADDR, port=config.PORT)
+    uvicorn.run(
+        app, host=config.BIND_ADDR, port=config.PORT,
+        loop="uvloop", http="httptools", workers=1,
+        timeout_keep_alive=75, backlog=2048, access_log=False, log_level="warning"
+    )
     